@@ -1,108 +1,183 @@
-import pandas as pd
 import json
+import orjson
 import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import time
 from urllib.parse import urlparse
-from collections import OrderedDict
+from collections import defaultdict
 import openpyxl
+from openpyxl.utils import column_index_from_string
 import shutil
+import shelve
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
 
 # Rakuten API Constants
 API_ENDPOINT = 'https://app.rakuten.co.jp/services/api/IchibaItem/Search/20220601'
 APP_ID = '1085274442429696242'
 AFFILIATE_ID = '494cbb7b.da2d8105.494cbb7c.3832fe1e'
 
+# Search parameters shared by every request; only the keyword changes per call
+BASE_PARAMS = {
+    'applicationId': APP_ID,
+    'affiliateId': AFFILIATE_ID,
+    'hits': 30,
+    'format': 'json'
+}
+
+# Set RAKUTEN_DEBUG=1 to print request/response details for every API call
+DEBUG = os.environ.get('RAKUTEN_DEBUG') == '1'
+
+# Shared session so every API call reuses the same keep-alive connection.
+# Rate limits and server errors are retried with exponential backoff,
+# honouring the Retry-After header when the API sends one.
+RETRY_POLICY = Retry(
+    total=5,
+    backoff_factor=2,
+    status_forcelist=[429, 500, 502, 503, 504],
+    respect_retry_after_header=True
+)
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=10, max_retries=RETRY_POLICY))
+
+# Concurrency settings - Rakuten allows roughly 1 request/second per applicationId
+MAX_WORKERS = 4
+REQUESTS_PER_SECOND = 1
+
+class RateLimiter:
+    """Thread-safe limiter that spaces calls at least 1/rate seconds apart"""
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_time = time.monotonic()
+        self.lock = Lock()
+
+    def acquire(self):
+        """Block until the caller is allowed to send the next request"""
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+RATE_LIMITER = RateLimiter(REQUESTS_PER_SECOND)
+
+# On-disk cache of API responses keyed by search keyword
+CACHE_PATH = 'rakuten_cache'
+CACHE_TTL_SECONDS = 86400
+cache_lock = Lock()
+
+def load_cached_response(keyword):
+    """Return a cached API response for keyword if it has not expired"""
+    with cache_lock, shelve.open(CACHE_PATH) as cache:
+        entry = cache.get(keyword)
+    if entry and time.time() - entry['cached_at'] < CACHE_TTL_SECONDS:
+        return entry['data']
+    return None
+
+def save_cached_response(keyword, data):
+    """Store a successful API response for keyword"""
+    with cache_lock, shelve.open(CACHE_PATH) as cache:
+        cache[keyword] = {'cached_at': time.time(), 'data': data}
+
 def fetch_item_details(search_term, sku_code):
     """Fetch item details using Rakuten Ichiba Item Search API"""
-    params = {
-        'applicationId': APP_ID,
-        'affiliateId': AFFILIATE_ID,
-        'keyword': search_term,
-        'hits': 30,
-        'format': 'json'
-    }
+    params = {**BASE_PARAMS, 'keyword': search_term}
+    
+    # Serve repeated searches from the cache without touching the API
+    cached = load_cached_response(search_term)
+    if cached is not None:
+        if DEBUG:
+            print(f"Using cached API response for SKU: {sku_code}")
+        return cached
     
     try:
-        print(f"\n=== DEBUG: Fetching data for SKU: {sku_code} ===")
-        print(f"Search term: {search_term}")
-        print(f"API URL: {API_ENDPOINT}")
-        print(f"Params: {params}")
+        if DEBUG:
+            print(f"\n=== DEBUG: Fetching data for SKU: {sku_code} ===")
+            print(f"Search term: {search_term}")
+            print(f"API URL: {API_ENDPOINT}")
+            print(f"Params: {params}")
         
-        response = requests.get(API_ENDPOINT, params=params)
+        RATE_LIMITER.acquire()
+        response = SESSION.get(API_ENDPOINT, params=params, timeout=15)
         response.raise_for_status()
         
         data = response.json()
         if 'error' in data:
             print(f"API Error: {data['error']}")
             return None
+        save_cached_response(search_term, data)
             
-        print(f"\nFound {len(data.get('Items', []))} items in API response")
-        if data.get('Items'):
-            print("\nFirst item preview:")
-            first_item = data['Items'][0]['Item']
-            print(f"itemName: {first_item.get('itemName', 'N/A')}")
-            print(f"itemCode: {first_item.get('itemCode', 'N/A')}")
-            print(f"shopName: {first_item.get('shopName', 'N/A')}")
-            print(f"shopUrl: {first_item.get('shopUrl', 'N/A')}")
-            print(f"itemUrl: {first_item.get('itemUrl', 'N/A')}")
+        if DEBUG:
+            print(f"\nFound {len(data.get('Items', []))} items in API response")
+            if data.get('Items'):
+                print("\nFirst item preview:")
+                first_item = data['Items'][0]['Item']
+                print(f"itemName: {first_item.get('itemName', 'N/A')}")
+                print(f"itemCode: {first_item.get('itemCode', 'N/A')}")
+                print(f"shopName: {first_item.get('shopName', 'N/A')}")
+                print(f"shopUrl: {first_item.get('shopUrl', 'N/A')}")
+                print(f"itemUrl: {first_item.get('itemUrl', 'N/A')}")
             
         return data
     except requests.exceptions.RequestException as e:
         print(f"Error fetching data: {e}")
-        if hasattr(e.response, 'text'):
-            print(f"Response text: {e.response.text}")
-        if e.response.status_code == 429:  # Too Many Requests
-            print("Rate limit hit, waiting 60 seconds...")
-            time.sleep(60)
-            return fetch_item_details(search_term, sku_code)  # Retry
+        response_text = getattr(e.response, 'text', '')
+        if response_text:
+            print(f"Response text: {response_text}")
         return None
 
 def format_sku_for_shop(sku: str) -> str:
     """Format SKU for first23 shop"""
-    try:
-        # Format for first23 shop
-        if sku and ':' in sku:
-            return 'first23:' + sku.split(':')[1]
-        return sku
-    except Exception as e:
-        print(f"Error formatting SKU {sku}: {e}")
+    if not sku:
         return sku
+    # Replace the shop prefix of "shop:item" codes with first23
+    _, sep, item_code = sku.partition(':')
+    return 'first23:' + item_code if sep else sku
 
 def match_shop_url(shop_name, items, search_term):
     """Match shop name with items from API response"""
     # Only look for first23 shop
     target_domain = "first23"
         
-    for item in items:
-        shop_url = item['Item'].get('shopUrl', '')
-        if target_domain in shop_url:
-            item_code = item['Item'].get('itemCode', '')
-            # Format item code for first23
-            formatted_code = format_sku_for_shop(item_code)
-            return {
-                'itemUrl': item['Item'].get('itemUrl', ''),
-                'itemPrice': str(item['Item'].get('itemPrice', '')),
-                'itemName': item['Item'].get('itemName', ''),
-                'shopUrl': shop_url,
-                'shopName': item['Item'].get('shopName', ''),
-                'itemCode': formatted_code,
-                '検索条件': format_sku_for_shop(search_term),  # Format search_term using the same function
-                'genreId': item['Item'].get('genreId', ''),
-                'tagline': item['Item'].get('tagline', ''),
-                'taxIncluded': item['Item'].get('taxIncluded', False)
-            }
-    return None
+    # Find the first item sold by the target shop
+    match = next(
+        (item['Item'] for item in items if target_domain in item['Item'].get('shopUrl', '')),
+        None
+    )
+    if match is None:
+        return None
 
-def load_progress(json_path):
-    """Load progress from existing JSON file"""
-    if os.path.exists(json_path):
-        try:
-            with open(json_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return []
-    return []
+    return {
+        'itemUrl': match.get('itemUrl', ''),
+        'itemPrice': str(match.get('itemPrice', '')),
+        'itemName': match.get('itemName', ''),
+        'shopUrl': match['shopUrl'],
+        'shopName': match.get('shopName', ''),
+        'itemCode': format_sku_for_shop(match.get('itemCode', '')),  # Format item code for first23
+        '検索条件': format_sku_for_shop(search_term),  # Format search_term using the same function
+        'genreId': match.get('genreId', ''),
+        'tagline': match.get('tagline', ''),
+        'taxIncluded': match.get('taxIncluded', False)
+    }
+
+def load_progress(progress_path):
+    """Load progress from existing JSON-Lines file (one processed SKU per line)"""
+    results = []
+    if os.path.exists(progress_path):
+        with open(progress_path, 'rb') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    results.append(orjson.loads(line))
+                except orjson.JSONDecodeError:
+                    # Partially written line from an interrupted run
+                    continue
+    return results
 
 def excel_to_single_nested_json(excel_path, json_path=None):
     """Convert Excel to single nested JSON format"""
@@ -110,12 +185,18 @@ def excel_to_single_nested_json(excel_path, json_path=None):
         json_path = os.path.splitext(excel_path)[0] + "_single.json"
     
     # Load existing progress
-    all_results = load_progress(json_path)
+    progress_path = json_path + "l"
+    all_results = load_progress(progress_path)
     processed_skus = {result["shop"]["SKUコード"] for result in all_results}
     
-    df = pd.read_excel(excel_path, sheet_name=0, header=2)  # Skip 2 metadata rows
-    
-
+    # Stream the first sheet read-only; row 3 holds the headers (rows 1-2 are metadata)
+    wb = openpyxl.load_workbook(excel_path, read_only=True, data_only=True)
+    ws = wb.worksheets[0]
+    header_row = next(ws.iter_rows(min_row=3, max_row=3, values_only=True), ())
+    header_index = {}
+    for i, name in enumerate(header_row):
+        if name is not None and str(name) not in header_index:
+            header_index[str(name)] = i
 
     # Define static shop names - only first23
     shop_names = ["first23"]
@@ -124,33 +205,65 @@ def excel_to_single_nested_json(excel_path, json_path=None):
     shop_columns = {
         "first23": ["価格", "ポイント", "クーポン", "在庫", "URL"]
     }
+
+    # Keep only the needed cells of each row as a plain tuple
+    needed_cols = ["SKUコード", "検索条件"] + shop_columns["first23"]
+    col_indexes = [header_index.get(col) for col in needed_cols]
+    # Stop reading at the last needed column so trailing columns are never parsed
+    max_col = max((i for i in col_indexes if i is not None), default=0) + 1
+    rows = [
+        tuple(values[i] if i is not None and i < len(values) else None for i in col_indexes)
+        for values in ws.iter_rows(min_row=4, max_col=max_col, values_only=True)
+        if any(v is not None for v in values)
+    ]
+    wb.close()
+
+    # Resolve once which shop columns exist and their output names (suffix like ".1" removed)
+    shop_clean_cols = [
+        (pos, col.split(".")[0])
+        for pos, col in enumerate(shop_columns["first23"])
+        if col in header_index
+    ]
     
+    # Collect rows to process first so the API calls can run concurrently
+    pending = []
+    for index, row in enumerate(rows):
+        sku_code = str(row[0]) if row[0] is not None else ""
+
+        # Skip if already processed
+        if sku_code in processed_skus:
+            print(f"Skipping already processed SKU {index + 1}/{len(rows)}: {sku_code}")
+            continue
+        processed_skus.add(sku_code)
+        pending.append((index, row, sku_code))
+
+    executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    progress_fp = open(progress_path, "ab")
     try:
+        # map() keeps the Excel row order while requests run in parallel
+        api_results = executor.map(
+            lambda sku: fetch_item_details(sku, sku) if sku else None,
+            [sku_code for _, _, sku_code in pending]
+        )
+
         # Process all rows
-        for index, row in df.iterrows():
-            result = {"shop": OrderedDict()}
-            search_term = row.get("検索条件", "") 
+        for (index, row, sku_code), api_data in zip(pending, api_results):
+            result = {"shop": {}}
+            _, search_term, *shop_values = row
+            search_term = search_term or ""
             # First add SKUコード
-            if "SKUコード" in df.columns:
-                val = row["SKUコード"]
-                result["shop"]["SKUコード"] = str(val) if pd.notna(val) else ""
-            
-            # Skip if already processed
-            sku_code = result["shop"].get("SKUコード", "")
-            if sku_code in processed_skus:
-                print(f"Skipping already processed SKU {index + 1}/{len(df)}: {sku_code}")
-                continue
+            if "SKUコード" in header_index:
+                result["shop"]["SKUコード"] = sku_code
             
             # Store API data temporarily
             api_item_name = None
             api_item_code = None
-            shop_data = OrderedDict()
+            shop_data = {}
 
             # Use SKU code for initial API search
             if sku_code:
                 print(f"\nSearching with SKU: {sku_code}")
                 # Search in first23 shop
-                api_data = fetch_item_details(sku_code, sku_code)
                 if api_data and 'Items' in api_data:
                     items = api_data['Items']
                     print(f"Found {len(items)} items in API response")
@@ -159,14 +272,9 @@ def excel_to_single_nested_json(excel_path, json_path=None):
                     for shop in shop_names:
                         shop_data[shop] = {}
                         # Get basic shop data from Excel
-                        for col in shop_columns[shop]:
-                            if col in df.columns:
-                                val = row[col]
-                                clean_col = col.split(".")[0]  # Remove suffix like ".1"
-                                if pd.isna(val):
-                                    shop_data[shop][clean_col] = ""
-                                else:
-                                    shop_data[shop][clean_col] = str(val)
+                        for pos, clean_col in shop_clean_cols:
+                            val = shop_values[pos]
+                            shop_data[shop][clean_col] = "" if val is None else str(val)
                         
                         # Add API data if found
                         api_match = match_shop_url(shop, items, sku_code)
@@ -186,49 +294,38 @@ def excel_to_single_nested_json(excel_path, json_path=None):
                             result["shop"]["商品名"] = api_match["itemName"]
                             result["shop"]["商品管理番号"] = api_match["itemCode"]
                             result["shop"]["検索条件"] = search_term
-                    
-                    # Add delay to avoid API rate limits
-                    time.sleep(1)
 
             # Now add all shop data
             for shop, data in shop_data.items():
                 result["shop"][shop] = data
 
             all_results.append(result)
-            processed_skus.add(sku_code)
-            print(f"Processed SKU {index + 1}/{len(df)}: {sku_code}")
+            print(f"Processed SKU {index + 1}/{len(rows)}: {sku_code}")
             
-            # Save progress periodically
-            if (index + 1) % 10 == 0:
-                with open(json_path, "w", encoding="utf-8") as f:
-                    json.dump(all_results, f, ensure_ascii=False, indent=2)
-                print(f"Progress saved: {len(all_results)} SKUs")
+            # Append progress so an interrupted run can resume
+            progress_fp.write(orjson.dumps(result) + b"\n")
+            progress_fp.flush()
 
     except KeyboardInterrupt:
         print("\nScript interrupted! Saving progress...")
     finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        progress_fp.close()
         # Final save
-        with open(json_path, "w", encoding="utf-8") as f:
-            json.dump(all_results, f, ensure_ascii=False, indent=2)
+        with open(json_path, "wb") as f:
+            f.write(orjson.dumps(all_results, option=orjson.OPT_INDENT_2))
         print(f"Single nested JSON saved to: {json_path} with {len(all_results)} SKUs")
 
 def update_excel_urls(json_path, excel_path, new_excel_path):
     """Update URLs and other data in the existing Excel file"""
     # Read JSON data
-    with open(json_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    with open(json_path, 'rb') as f:
+        data = orjson.loads(f.read())
     
     print("\n=== DEBUG: First item in JSON data ===")
     if data:
         print(json.dumps(data[0], indent=2, ensure_ascii=False))
     
-    # Copy original Excel file
-    shutil.copy2(excel_path, new_excel_path)
-    
-    # Load the copied Excel file
-    wb = openpyxl.load_workbook(new_excel_path)
-    ws = wb.active
-    
     # URL cell mappings for each shop
     url_cells = {
         'e-life＆work shop': 'R',
@@ -236,11 +333,22 @@ def update_excel_urls(json_path, excel_path, new_excel_path):
         '晃栄産業　楽天市場店': 'AB',
         'Dear worker ディアワーカー': 'AG'
     }
+    url_col_indexes = {shop_name: column_index_from_string(col) for shop_name, col in url_cells.items()}
+    
+    # Fixed column indexes for common fields
+    code_col = column_index_from_string('B')   # 商品管理番号
+    name_col = column_index_from_string('C')   # 商品名
+    search_col = column_index_from_string('D') # 検索条件
+    price_col = column_index_from_string('H')  # price
+    tax_col = column_index_from_string('J')    # tax include
+    
+    # Cell values collected per column as (row, value), written in one pass at the end
+    updates = defaultdict(list)
     
     # Start from row 4
     current_row = 4
     
-    # Update URLs and other data for each item
+    # Collect URLs and other data for each item
     for item in data:
         shop_data = item['shop']
         print(f"\n=== DEBUG: Processing row {current_row} ===")
@@ -261,35 +369,46 @@ def update_excel_urls(json_path, excel_path, new_excel_path):
         
         # Update common fields if we have data
         if shop_data.get("商品名"):
-            ws[f'C{current_row}'] = shop_data["商品名"]
+            updates[name_col].append((current_row, shop_data["商品名"]))
            
         if shop_data.get("商品管理番号"):
-            ws[f'B{current_row}'] = shop_data["商品管理番号"]
+            updates[code_col].append((current_row, shop_data["商品管理番号"]))
             
         if shop_data.get("検索条件"):
-            ws[f'D{current_row}'] = shop_data["検索条件"]
+            updates[search_col].append((current_row, shop_data["検索条件"]))
             
 
         if first_shop_data:
             if first_shop_data.get('itemPrice'):
-                ws[f'H{current_row}'] = first_shop_data['itemPrice']  # price
+                updates[price_col].append((current_row, first_shop_data['itemPrice']))
                 print(f"Writing price to H{current_row}: {first_shop_data['itemPrice']}")
             if 'taxIncluded' in first_shop_data:
                 tax_value = '1' if first_shop_data['taxIncluded'] else '0'
-                ws[f'J{current_row}'] = tax_value  # tax include
+                updates[tax_col].append((current_row, tax_value))
                 
         
         # Update shop-specific URLs
-        for shop_name, column in url_cells.items():
+        for shop_name, column in url_col_indexes.items():
             if shop_name in shop_data:
                 shop_info = shop_data[shop_name]
                 url = shop_info.get('URL', '')
-                cell = f"{column}{current_row}"
-                ws[cell] = url
-                print(f"Writing URL for {shop_name} to {cell}: {url}")
+                updates[column].append((current_row, url))
+                print(f"Writing URL for {shop_name} to {url_cells[shop_name]}{current_row}: {url}")
         
         current_row += 1
     
+    # Copy original Excel file
+    shutil.copy2(excel_path, new_excel_path)
+    
+    # Load the copied Excel file
+    wb = openpyxl.load_workbook(new_excel_path)
+    ws = wb.active
+    
+    # Apply all collected updates column by column
+    for column, cells in updates.items():
+        for row, value in cells:
+            ws.cell(row=row, column=column, value=value)
+    
     # Save the workbook
     wb.save(new_excel_path)
     print(f"\nURLs and data updated in Excel file: {new_excel_path}")
@@ -1,19 +1,50 @@
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import orjson
 import time
 import re
-import pandas as pd
 from typing import List, Dict
 from datetime import datetime
 import base64
 import openpyxl
+from openpyxl.utils import column_index_from_string
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from threading import Lock
+from functools import lru_cache
 
 # Constants
 API_ENDPOINT = 'https://app.rakuten.co.jp/services/api/IchibaItem/Search/20220601'
 APP_ID = "1085274442429696242"  # Rakuten Application ID
 
+# Query parameters shared by every Ichiba search
+BASE_PARAMS = {
+    'applicationId': APP_ID,
+    'hits': 10,
+    'format': 'json',
+    'availability': 1
+}
+
+# SKU formatters per shop (SKUs look like asc-1271a029-025-250)
+@lru_cache(maxsize=1024)
+def format_waste_sku(sku: str) -> str:
+    """Extract model number (e.g., 1271a029)"""
+    return sku.split('-')[1]
+
+@lru_cache(maxsize=1024)
+def format_kougushop_sku(sku: str) -> str:
+    """Extract model number with color code (e.g., 1271a029-025)"""
+    parts = sku.split('-')
+    return f"{parts[1]}-{parts[2]}"
+
+def format_kouei_sangyou_sku(sku: str) -> str:
+    """Fixed format for CP209"""
+    return "fcp209"
+
+def format_dear_worker_sku(sku: str) -> str:
+    """Fixed format for CP209 BOA"""
+    return "cp209boa"
+
 # Define shop configurations
 SHOPS = {
     'waste': {  # e-life＆work shop
@@ -21,31 +52,90 @@ SHOPS = {
         'shop_code': 'waste',
         'base_url': 'https://item.rakuten.co.jp/waste/',
         'description': 'Main shop for safety equipment and work gear',
-        'sku_format': lambda sku: sku.split('-')[1]  # Extract model number (e.g., 1271a029)
+        'sku_format': format_waste_sku
     },
     'kougushop': {  # 工具ショップ
         'shop_code': 'kougushop',
         'name': '工具ショップ',
         'base_url': 'https://item.rakuten.co.jp/kougushop/',
         'description': 'Specialized in tools and safety equipment',
-        'sku_format': lambda sku: f"{sku.split('-')[1]}-{sku.split('-')[2]}"  # Format: 1271a029-025
+        'sku_format': format_kougushop_sku
     },
     'kouei-sangyou': {  # 晃栄産業
         'name': '晃栄産業',
         'shop_code': 'kouei-sangyou',
         'base_url': 'https://item.rakuten.co.jp/kouei-sangyou/',
         'description': 'Industrial safety equipment supplier',
-        'sku_format': lambda sku: f"fcp209"  # Fixed format for CP209
+        'sku_format': format_kouei_sangyou_sku
     },
     'dear-worker': {  # dear-worker
         'name': 'dear-worker',
         'shop_code': 'dear-worker',
         'base_url': 'https://item.rakuten.co.jp/dear-worker/',
         'description': 'Worker safety equipment specialist',
-        'sku_format': lambda sku: f"cp209boa"  # Fixed format for CP209 BOA
+        'sku_format': format_dear_worker_sku
     }
 }
 
+# Precompiled patterns for caption parsing
+WHITESPACE_RE = re.compile(r'\s+')
+NEWLINES_RE = re.compile(r'\n+')
+COLON_RE = re.compile(r'[：:]\s*')
+SIZE_RE = re.compile(r'(\d{2}\.?\d?)\s*cm')
+
+# Common Japanese spec patterns. Kept as separate regexes: each starts with a
+# literal the engine can jump to, which a single combined scan would lose.
+SPEC_PATTERNS = {
+    '幅/ラスト': re.compile(r'幅[/／]?ラスト[：:]?\s*([^。\n]+)'),
+    'アッパー素材': re.compile(r'アッパー素材[：:]?\s*([^。\n]+)'),
+    'アウター素材': re.compile(r'アウター素材[：:]?\s*([^。\n]+)'),
+    'インナーソール': re.compile(r'インナーソール[：:]?\s*([^。\n]+)'),
+    '品番': re.compile(r'品番\s*[：:]\s*([^。\n]+)'),
+    'サイズ': re.compile(r'サイズ[：:]?\s*([^。\n]+)'),
+    '重量': re.compile(r'重量[：:]?\s*([^。\n]+)'),
+    '生産国': re.compile(r'Made in ([^。\n]+)'),
+}
+
+# Rakuten allows roughly 1 request/second per applicationId
+REQUESTS_PER_SECOND = 1
+
+# Number of (SKU, shop) lookups run concurrently, sized to keep the rate
+# limiter busy while a response is in flight; extra workers would only queue
+MAX_WORKERS = REQUESTS_PER_SECOND + 1
+
+# Shared session so all workers reuse pooled keep-alive connections.
+# Rate limits and server errors are retried with exponential backoff.
+RETRY_POLICY = Retry(
+    total=3,
+    backoff_factor=0.5,
+    status_forcelist=[429, 500, 502, 503, 504],
+    respect_retry_after_header=True
+)
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS, max_retries=RETRY_POLICY))
+
+# (connect, read) timeouts for API calls
+REQUEST_TIMEOUT = (3.05, 10)
+
+class RateLimiter:
+    """Thread-safe limiter that spaces calls at least 1/rate seconds apart"""
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_time = time.monotonic()
+        self.lock = Lock()
+
+    def acquire(self):
+        """Block until the caller is allowed to send the next request"""
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+# Shared by all workers so the whole pool stays within the API limit
+RATE_LIMITER = RateLimiter(REQUESTS_PER_SECOND)
+
 # Thread-safe print lock
 print_lock = Lock()
 
@@ -65,25 +155,23 @@ def clean_text(text):
     if not text:
         return ""
     # Replace multiple spaces with single space
-    text = re.sub(r'\s+', ' ', text)
+    text = WHITESPACE_RE.sub(' ', text)
     # Replace multiple newlines with single newline
-    text = re.sub(r'\n+', '\n', text)
+    text = NEWLINES_RE.sub('\n', text)
     return text.strip()
 
 def extract_sizes(caption):
     """Extract size information from item caption"""
-    sizes = []
     if not caption:
-        return sizes
+        return []
         
     # Look for size patterns like "25.5cm" or "25.5 cm"
-    size_pattern = r'(\d{2}\.?\d?)\s*cm'
-    matches = re.finditer(size_pattern, caption)
-    for match in matches:
+    sizes = set()
+    for match in SIZE_RE.finditer(caption):
         size = match.group(1)
         if 20 <= float(size) <= 31:  # Reasonable shoe size range
-            sizes.append(f"{size}cm")
-    return sorted(list(set(sizes)))  # Remove duplicates and sort
+            sizes.add(f"{size}cm")
+    return sorted(sizes)
 
 def extract_specs(caption):
     """Extract specifications from item caption"""
@@ -91,26 +179,14 @@ def extract_specs(caption):
     if not caption:
         return specs
     
-    # Common Japanese spec patterns
-    known_specs = {
-        '幅/ラスト': r'幅[/／]?ラスト[：:]?\s*([^。\n]+)',
-        'アッパー素材': r'アッパー素材[：:]?\s*([^。\n]+)',
-        'アウター素材': r'アウター素材[：:]?\s*([^。\n]+)',
-        'インナーソール': r'インナーソール[：:]?\s*([^。\n]+)',
-        '品番': r'品番\s*[：:]\s*([^。\n]+)',
-        'サイズ': r'サイズ[：:]?\s*([^。\n]+)',
-        '重量': r'重量[：:]?\s*([^。\n]+)',
-        '生産国': r'Made in ([^。\n]+)',
-    }
-    
     # Extract each specification
-    for key, pattern in known_specs.items():
-        match = re.search(pattern, caption)
+    for key, pattern in SPEC_PATTERNS.items():
+        match = pattern.search(caption)
         if match:
             value = match.group(1).strip()
             # Clean up the value
-            value = re.sub(r'\s+', ' ', value)  # Normalize spaces
-            value = re.sub(r'[：:]\s*', ': ', value)  # Normalize colons
+            value = WHITESPACE_RE.sub(' ', value)  # Normalize spaces
+            value = COLON_RE.sub(': ', value)  # Normalize colons
             specs[key] = value
     
     return specs
@@ -123,23 +199,16 @@ def format_sku_for_shop(sku: str, shop_info: dict) -> str:
         safe_print(f"Error formatting SKU {sku} for {shop_info['name']}: {e}")
         return sku
 
-def fetch_ichiba_details(code: str, shop_code: str, shop_info: dict) -> list:
-    """Fetch shop-specific info from Ichiba API"""
+def fetch_ichiba_details(search_code: str, shop_code: str, shop_info: dict) -> list:
+    """Fetch shop-specific info from Ichiba API for an already formatted search code"""
     try:
-        search_code = format_sku_for_shop(code, shop_info)
-        params = {
-            'applicationId': APP_ID,
-            'shopCode': shop_code,
-            'keyword': search_code,
-            'hits': 10,
-            'format': 'json',
-            'availability': 1
-        }
+        params = {**BASE_PARAMS, 'shopCode': shop_code, 'keyword': search_code}
         
         safe_print(f"Searching in Ichiba API for {shop_info['name']} with code: {search_code}")
-        response = requests.get(API_ENDPOINT, params=params)
+        RATE_LIMITER.acquire()
+        response = SESSION.get(API_ENDPOINT, params=params, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
-        data = response.json()
+        data = orjson.loads(response.content)
         
         shop_items = []
         if data.get('Items'):
@@ -158,12 +227,11 @@ def fetch_ichiba_details(code: str, shop_code: str, shop_info: dict) -> list:
                 })
         return shop_items
     except Exception as e:
-        safe_print(f"[Ichiba API ERROR] code={code}, shop={shop_code}: {e}")
+        safe_print(f"[Ichiba API ERROR] code={search_code}, shop={shop_code}: {e}")
         return []
 
-def process_shop(code: str, shop_code: str, shop_info: dict) -> dict:
-    """Process a single shop for a given SKU"""
-    ichiba_items = fetch_ichiba_details(code, shop_code, shop_info)
+def process_shop(code: str, search_code: str, shop_code: str, shop_info: dict, ichiba_items: list) -> list:
+    """Build the results of a single shop for a given SKU from its Ichiba items"""
     results = []
     
     for ichiba_item in ichiba_items:
@@ -172,7 +240,7 @@ def process_shop(code: str, shop_code: str, shop_info: dict) -> dict:
         
         result = {
             'original_sku': code,
-            'search_code_used': format_sku_for_shop(code, shop_info),
+            'search_code_used': search_code,
             'product_info': {
                 '商品管理番号': ichiba_item['manage_number'],
                 '商品名': ichiba_item['name'],
@@ -203,33 +271,15 @@ def process_shop(code: str, shop_code: str, shop_info: dict) -> dict:
     
     return results
 
-def process_sku(sku: str) -> list:
-    """Process a single SKU across all shops"""
-    all_results = []
-    
-    # Process each shop in parallel
-    with ThreadPoolExecutor(max_workers=len(SHOPS)) as executor:
-        future_to_shop = {
-            executor.submit(process_shop, sku, shop_code, shop_info): (shop_code, shop_info)
-            for shop_code, shop_info in SHOPS.items()
-        }
-        
-        for future in as_completed(future_to_shop):
-            shop_code, shop_info = future_to_shop[future]
-            try:
-                results = future.result()
-                all_results.extend(results)
-            except Exception as e:
-                safe_print(f"Error processing {shop_code} for SKU {sku}: {e}")
-    
-    return all_results
-
 def read_skus_from_excel(excel_path):
     """Read SKUs from first column of Excel file"""
     try:
-        df = pd.read_excel(excel_path)
+        # Stream only column A in read-only mode; row 1 is the header
+        wb = openpyxl.load_workbook(excel_path, read_only=True, data_only=True)
+        ws = wb.worksheets[0]
+        skus = [str(value) for (value,) in ws.iter_rows(min_row=2, max_col=1, values_only=True) if value is not None]
+        wb.close()
         # Clean SKUs - remove header row if it exists
-        skus = df.iloc[:, 0].dropna().astype(str).tolist()
         return [sku for sku in skus if sku.lower() != 'skuコード']
     except Exception as e:
         print(f"Error reading Excel file: {e}")
@@ -251,13 +301,14 @@ def print_table_header(columns: List[str], widths: List[int]) -> None:
 
 def print_table_row(data: List[str], widths: List[int]) -> None:
     """Print a table row with proper formatting"""
-    # Split long data into multiple rows if needed
-    max_lines = max(len(str(d).split('\n')) for d in data)
+    # Split each value into lines once; long data spans multiple rows
+    lines_per_col = [str(d).split('\n') for d in data]
+    max_lines = max(len(lines) for lines in lines_per_col)
     
     for line_num in range(max_lines):
         row = "|"
-        for value, width in zip(data, widths):
-            value_str = str(value).split('\n')[line_num] if line_num < len(str(value).split('\n')) else ''
+        for lines, width in zip(lines_per_col, widths):
+            value_str = lines[line_num] if line_num < len(lines) else ''
             value_str = truncate_str(value_str, width)
             
             # Right-align numbers (including those with ¥), left-align text
@@ -271,7 +322,8 @@ def print_table_row(data: List[str], widths: List[int]) -> None:
     print("+" + "+".join("-" * (w + 2) for w in widths) + "+")
 
 def main():
-    start_time = time.time()
+    start_time = time.monotonic()
+    start_time_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     
     # Read SKUs from Excel
     excel_path = "New folder/araki.xlsx"
@@ -293,21 +345,42 @@ def main():
         }
     }
     
-    # Process SKUs in parallel
-    with ThreadPoolExecutor(max_workers=4) as executor:
-        future_to_sku = {executor.submit(process_sku, sku): sku for sku in skus}
+    # Number of shop lookups still outstanding per SKU
+    remaining_shops = {}
+    for sku in skus:
+        remaining_shops[sku] = remaining_shops.get(sku, 0) + len(SHOPS)
+    
+    # Group SKUs by the (shop, search code) query they need. Many SKUs share a
+    # model code per shop (and some shops use a fixed code), so each distinct
+    # query is sent once and its items are reused for every SKU that needs it.
+    queries = {}
+    for sku in skus:
+        for shop_code, shop_info in SHOPS.items():
+            search_code = format_sku_for_shop(sku, shop_info)
+            queries.setdefault((shop_code, search_code), []).append(sku)
+    
+    # Fan out the distinct queries onto one shared pool
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        future_to_query = {
+            executor.submit(fetch_ichiba_details, search_code, shop_code, SHOPS[shop_code]): (shop_code, search_code)
+            for shop_code, search_code in queries
+        }
         
-        for future in as_completed(future_to_sku):
-            sku = future_to_sku[future]
-            try:
-                results = future.result()
-                all_results['items'].extend(results)
-                safe_print(f"Completed processing SKU: {sku}")
-            except Exception as e:
-                safe_print(f"Error processing SKU {sku}: {e}")
+        for future in as_completed(future_to_query):
+            shop_code, search_code = future_to_query[future]
+            ichiba_items = future.result()
+            for sku in queries[(shop_code, search_code)]:
+                try:
+                    results = process_shop(sku, search_code, shop_code, SHOPS[shop_code], ichiba_items)
+                    all_results['items'].extend(results)
+                except Exception as e:
+                    safe_print(f"Error processing {shop_code} for SKU {sku}: {e}")
+                remaining_shops[sku] -= 1
+                if remaining_shops[sku] == 0:
+                    safe_print(f"Completed processing SKU: {sku}")
     
     # Calculate total time
-    total_time = time.time() - start_time
+    total_time = time.monotonic() - start_time
     
     # Add timing info to results
     all_results['metadata'] = {
@@ -315,12 +388,12 @@ def main():
         'average_time_per_sku': round(total_time / len(skus), 2) if skus else 0,
         'total_skus_processed': len(skus),
         'total_items_found': len(all_results['items']),
-        'start_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        'start_time': start_time_str
     }
     
     # Save results to JSON file
-    with open('results.json', 'w', encoding='utf-8') as f:
-        json.dump(all_results, ensure_ascii=False, indent=2, fp=f)
+    with open('results.json', 'wb') as f:
+        f.write(orjson.dumps(all_results, option=orjson.OPT_INDENT_2))
     
     print(f"\nProcessing completed:")
     print(f"Total time: {total_time:.2f} seconds")
@@ -329,74 +402,57 @@ def main():
     print(f"Total items found: {len(all_results['items'])}")
     print(f"Results saved to results.json")
 
+# Excel column indexes for the common product fields
+PRODUCT_COLUMNS = [
+    ('商品名', column_index_from_string('C')),
+    ('商品管理番号', column_index_from_string('B')),
+    ('検索条件', column_index_from_string('D')),
+    ('在庫', column_index_from_string('F')),
+]
+
+# Excel (url column, price column) indexes per shop
+SHOP_COLUMNS = {
+    'waste': (column_index_from_string('R'), column_index_from_string('N')),          # e-life＆work shop
+    'kougushop': (column_index_from_string('W'), column_index_from_string('S')),      # 工具ショップ
+    'kouei-sangyou': (column_index_from_string('AB'), column_index_from_string('X')), # 晃栄産業　楽天市場店
+    'dear-worker': (column_index_from_string('AG'), column_index_from_string('AC'))   # Dear worker ディアワーカー
+}
+
 def update_excel_with_results(json_path, excel_path):
     """Update Excel file with results from JSON data"""
     # Read JSON data
-    with open(json_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    # Load Excel file
-    wb = openpyxl.load_workbook(excel_path)
-    ws = wb.active
-    
-    # Start from row 4 (as per previous pattern)
-    current_row = 4
+    with open(json_path, 'rb') as f:
+        data = orjson.loads(f.read())
     
-    # Process each item
+    # Build every (column, value) write per row first, starting from row 4
+    row_writes = []
     for item in data['items']:
         product_info = item['product_info']
         shop_info = item['shop_info']
+        writes = []
         
-        # Update common fields
-        if product_info.get('商品名'):
-            ws[f'C{current_row}'] = product_info['商品名']
-            
-        if product_info.get('商品管理番号'):
-            ws[f'B{current_row}'] = product_info['商品管理番号']
-            
-        if product_info.get('検索条件'):
-            ws[f'D{current_row}'] = product_info['検索条件']
-            
-        # Add 在庫 status in column F
-        if product_info.get('在庫'):
-            ws[f'F{current_row}'] = product_info['在庫']
-            
-        # # Update price in column H
-        # if product_info.get('FA売価(税込)'):
-        #     ws[f'H{current_row}'] = product_info['FA売価(税込)']
-            
-        # Shop mappings for URLs and prices
-        shop_mappings = {
-            'waste': {          # e-life＆work shop
-                'url_col': 'R',
-                'price_col': 'N'
-            },
-            'kougushop': {      # 工具ショップ
-                'url_col': 'W',
-                'price_col': 'S'
-            },
-            'kouei-sangyou': {  # 晃栄産業　楽天市場店
-                'url_col': 'AB',
-                'price_col': 'X'
-            },
-            'dear-worker': {    # Dear worker ディアワーカー
-                'url_col': 'AG',
-                'price_col': 'AC'
-            }
-        }
+        # Common fields, including 在庫 status in column F
+        for key, column in PRODUCT_COLUMNS:
+            if product_info.get(key):
+                writes.append((column, product_info[key]))
         
-        # Update URLs and prices for each shop
-        for shop_code, columns in shop_mappings.items():
+        # URLs and prices for each shop
+        for shop_code, (url_column, price_column) in SHOP_COLUMNS.items():
             if shop_code in shop_info:
                 shop_data = shop_info[shop_code]
-                # Update URL
                 if 'URL' in shop_data:
-                    ws[f'{columns["url_col"]}{current_row}'] = shop_data['URL']
-                # Update price
+                    writes.append((url_column, shop_data['URL']))
                 if '価格' in shop_data:
-                    ws[f'{columns["price_col"]}{current_row}'] = shop_data['価格']
+                    writes.append((price_column, shop_data['価格']))
         
-        current_row += 1
+        row_writes.append(writes)
+    
+    # Load Excel file and apply all writes in one tight loop
+    wb = openpyxl.load_workbook(excel_path)
+    ws = wb.active
+    for row, writes in enumerate(row_writes, start=4):
+        for column, value in writes:
+            ws.cell(row=row, column=column, value=value)
     
     # Save the workbook
     wb.save(excel_path)
@@ -1,14 +1,36 @@
 import pandas as pd
 import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import base64
 import sys
 import argparse
+import re
+from concurrent.futures import ThreadPoolExecutor
 
 # Constants for Rakuten RMS API
 RAKUTEN_API_ITEM_ENDPOINT_TEMPLATE = 'https://api.rms.rakuten.co.jp/es/2.0/items/manage-numbers/{}'
 
+# Shop code and item code from an item page URL, e.g. https://item.rakuten.co.jp/waste/cp209/
+RAKUTEN_ITEM_URL_RE = re.compile(r'(?:^|/)item\.rakuten\.co\.jp/([^/?#]+)/([^/?#]+)')
+
+# Number of RMS item lookups in flight at once
+MAX_WORKERS = 4
+
+# Shared session so all workers reuse pooled keep-alive connections,
+# retrying throttled (429) and transient server errors with backoff
+RETRY_POLICY = Retry(
+    total=3,
+    backoff_factor=1,
+    status_forcelist=[429, 500, 502, 503, 504],
+    respect_retry_after_header=True,
+    raise_on_status=False
+)
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=MAX_WORKERS, max_retries=RETRY_POLICY))
+
 def get_rakuten_api_auth(service_secret=None, license_key=None):
     """
     Creates authorization header using serviceSecret and licenseKey.
@@ -34,18 +56,16 @@ def get_rakuten_api_auth(service_secret=None, license_key=None):
         print(f"Error creating authorization header: {e}")
         return None
 
-def fetch_rakuten_item_details(manage_number, auth_token):
+def fetch_rakuten_item_details(manage_number):
     """
     Fetches item details from Rakuten API using the manage_number.
+    Expects the Authorization header to be set on SESSION.
     """
     api_url = RAKUTEN_API_ITEM_ENDPOINT_TEMPLATE.format(manage_number)
-    headers = {
-        'Authorization': auth_token
-    }
     
     try:
         print(f"Fetching data from: {api_url}")
-        response = requests.get(api_url, headers=headers, timeout=15)
+        response = SESSION.get(api_url, timeout=15)
         response.raise_for_status()  # Raise an exception for HTTP errors
         return response.json()
     except requests.exceptions.HTTPError as http_err:
@@ -65,10 +85,12 @@ def process_excel(service_secret=None, license_key=None):
     # Read Excel file
     try:
         print("Reading Excel file...")
-        df = pd.read_excel('araki.xlsx', engine='openpyxl')
+        # Only the URL columns are used; repeated "URL" headers load as URL.1, URL.2
+        url_columns = ['URL', 'URL.1', 'URL.2']
+        df = pd.read_excel('araki.xlsx', engine='openpyxl', usecols=lambda column: column in url_columns)
         
         # Print column names to verify structure
-        print("\nAvailable columns in Excel:")
+        print("\nURL columns found in Excel:")
         for col in df.columns:
             print(f"- {col}")
         
@@ -76,53 +98,61 @@ def process_excel(service_secret=None, license_key=None):
         auth_token = get_rakuten_api_auth(service_secret, license_key)
         if not auth_token:
             return
+        # Send the ESA token with every request on the shared session
+        SESSION.headers['Authorization'] = auth_token
         
         # Create output columns based on the headers
-        result_df = pd.DataFrame(columns=[
+        output_columns = [
             '商品管理番号商品名', '検索条件 検索除外', '在庫', '定価', '仕入金額',
             '平均単価（税込）', 'FA売価(税込)', '粗利', 'RT後の利益FA売価(税込)',
             '価格', 'ポイント', 'クーポン', '在庫'
-        ])
+        ]
+        # Collect result rows and build the DataFrame once at the end
+        result_rows = []
         
         # Look for URLs in the URL columns
-        url_columns = ['URL', 'URL.1', 'URL.2']
-        processed_urls = set()
+        # Distinct manage numbers in sheet order; fetched concurrently once all URLs are
+        # parsed. Keyed by item rather than URL so query-string variants are fetched once.
+        manage_numbers = {}
         
         for url_col in url_columns:
             if url_col not in df.columns:
                 continue
                 
             print(f"\nProcessing URLs from column: {url_col}")
-            for index, row in df.iterrows():
-                url = str(row.get(url_col, ''))
-                if not url or pd.isna(url) or url in processed_urls:
+            for value in df[url_col].tolist():
+                url = str(value)
+                if not url or pd.isna(url):
                     continue
                     
-                processed_urls.add(url)
                 print(f"Processing URL: {url}")
                 
                 # Extract shop and item code from URL
                 if 'item.rakuten.co.jp' in url:
-                    parts = url.split('/')
-                    try:
-                        shop_code = parts[parts.index('item.rakuten.co.jp') + 1]
-                        item_code = parts[parts.index('item.rakuten.co.jp') + 2].split('?')[0]
-                        manage_number = f"{shop_code}:{item_code}"
-                        
-                        item_data = fetch_rakuten_item_details(manage_number, auth_token)
-                        if item_data:
-                            # Map the data to our result columns
-                            new_row = {
-                                '商品管理番号商品名': item_data.get('title', ''),
-                                '在庫': item_data.get('variants', {}).get(manage_number, {}).get('inventoryCount', 0),
-                                '価格': item_data.get('variants', {}).get(manage_number, {}).get('standardPrice', 0),
-                                # Other columns would be filled based on business logic
-                            }
-                            result_df = pd.concat([result_df, pd.DataFrame([new_row])], ignore_index=True)
-                    except (ValueError, IndexError) as e:
-                        print(f"Could not parse URL: {url} - Error: {e}")
+                    match = RAKUTEN_ITEM_URL_RE.search(url)
+                    if match:
+                        shop_code, item_code = match.groups()
+                        manage_numbers.setdefault(f"{shop_code}:{item_code}", None)
+                    else:
+                        print(f"Could not parse URL: {url}")
+        
+        # Fetch each manage number once, several at a time
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            item_details = executor.map(fetch_rakuten_item_details, manage_numbers)
+        
+        for manage_number, item_data in zip(manage_numbers, item_details):
+            if item_data:
+                # Map the data to our result columns
+                new_row = {
+                    '商品管理番号商品名': item_data.get('title', ''),
+                    '在庫': item_data.get('variants', {}).get(manage_number, {}).get('inventoryCount', 0),
+                    '価格': item_data.get('variants', {}).get(manage_number, {}).get('standardPrice', 0),
+                    # Other columns would be filled based on business logic
+                }
+                result_rows.append(new_row)
         
         # Save results
+        result_df = pd.DataFrame(result_rows, columns=output_columns)
         output_file = 'processed_results.xlsx'
         result_df.to_excel(output_file, index=False, encoding='utf-8')
         print(f"\nProcessing complete. Results saved to '{output_file}'")
@@ -1,10 +1,6 @@
 import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
+from tkinter import ttk, messagebox
 import pandas as pd
-import json
-import os
-import csv
-import numpy as np # For random data in placeholder
 
 class MultiColumnTreeview(ttk.Treeview):
     def __init__(self, master, **kw):
@@ -125,13 +121,9 @@ class ExcelApp:
         main_frame = tk.Frame(self.root)
         main_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
 
-        # Create header frames
-        self.header_frames = []
-        for i in range(3):
-            frame = tk.Frame(main_frame, height=25)
-            frame.pack(fill=tk.X, pady=(0, 1))
-            frame.pack_propagate(False)  # Prevent frame from shrinking
-            self.header_frames.append(frame)
+        # Create a single canvas holding all three header rows
+        self.header_canvas = tk.Canvas(main_frame, height=75, highlightthickness=0)
+        self.header_canvas.pack(fill=tk.X, pady=(0, 1))
 
         # Create table frame
         table_frame = tk.Frame(main_frame)
@@ -197,30 +189,30 @@ class ExcelApp:
                 # Calculate total width for this section
                 section_width = sum(column_widths.get(col, 80) for col in columns)
                 
-                # Create main category label
-                main_label = tk.Label(self.header_frames[0], text=main_cat, 
-                                    relief="solid", borderwidth=1)
-                main_label.place(x=current_x, y=0, width=section_width, height=25)
+                # Draw main category cell
+                self._draw_header_cell(0, main_cat, current_x, section_width)
                 
-                # Create subcategory label
+                # Draw subcategory cell
                 if subcat:
                     bg_color = self.shop_colors.get(subcat, 'white')
-                    sub_label = tk.Label(self.header_frames[1], text=subcat,
-                                       relief="solid", borderwidth=1, bg=bg_color)
-                    sub_label.place(x=current_x, y=0, width=section_width, height=25)
+                    self._draw_header_cell(1, subcat, current_x, section_width, bg_color)
                 
                 # Set up individual columns
                 for col in columns:
                     width = column_widths.get(col, 80)
-                    # Create column header label
-                    col_label = tk.Label(self.header_frames[2], text=col,
-                                       relief="solid", borderwidth=1)
-                    col_label.place(x=current_x, y=0, width=width, height=25)
+                    # Draw column header cell
+                    self._draw_header_cell(2, col, current_x, width)
                     
                     # Configure treeview column
                     self.tree.column(col, width=width, anchor='center')
                     current_x += width
 
+    def _draw_header_cell(self, row, text, x, width, bg_color=''):
+        """Draw one bordered header cell on the header canvas"""
+        y = row * 25
+        self.header_canvas.create_rectangle(x, y, x + width, y + 25, fill=bg_color, outline='black')
+        self.header_canvas.create_text(x + width / 2, y + 12, text=text)
+
     def recalculate_all(self):
         messagebox.showinfo("Info", "Recalculate All functionality will be implemented later.")
 
@@ -1,16 +1,90 @@
-import pandas as pd
+import openpyxl
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from bs4 import BeautifulSoup
-import json
+import orjson
 import time
 from datetime import datetime
 import random
+import re
+
+# Everything that is not a digit, e.g. currency symbols, commas and "円"
+NON_DIGIT_RE = re.compile(r'\D+')
+NON_NUMBER_RE = re.compile(r'[^\d.]+')
+
+# Retry throttled or failing page loads with backoff instead of parsing error pages
+RETRY_POLICY = Retry(
+    total=3,
+    backoff_factor=1,
+    status_forcelist=[429, 500, 502, 503, 504],
+    respect_retry_after_header=True,
+    raise_on_status=False
+)
+
+# (connect, read) timeouts for page loads
+REQUEST_TIMEOUT = (3.05, 15)
+
+# libxml2-backed parser, much faster than the pure-Python html.parser
+HTML_PARSER = 'lxml'
+
+def extract_digits(text):
+    """Strip every non-digit character from text"""
+    return NON_DIGIT_RE.sub('', text)
+
+# Affiliate tracking id appended to every item URL
+RAFCID = 'wsc_i_is_1085274442429696242'
+
+# Item page paths per shop (SKUs look like asc-1271a029-025-250)
+def waste_item_path(sku):
+    """Fixed item page for CP209"""
+    return "cp209"
+
+def kougushop_item_path(sku):
+    """Model number with color code (e.g., 1271a029-025)"""
+    parts = sku.split('-')
+    return f"{parts[1]}-{parts[2]}"
+
+def kouei_sangyou_item_path(sku):
+    """Fixed item page for CP209"""
+    return "fcp209"
+
+def dear_worker_item_path(sku):
+    """Fixed item page for CP209 BOA"""
+    return "cp209boa"
+
+# Shops scraped for every SKU
+SHOPS = {
+    'waste': {
+        'name': 'e-life＆work shop',
+        'base_url': 'https://item.rakuten.co.jp/waste/',
+        'item_path': waste_item_path
+    },
+    'kougushop': {
+        'name': '工具ショップ',
+        'base_url': 'https://item.rakuten.co.jp/kougushop/',
+        'item_path': kougushop_item_path
+    },
+    'kouei-sangyou': {
+        'name': '晃栄産業',
+        'base_url': 'https://item.rakuten.co.jp/kouei-sangyou/',
+        'item_path': kouei_sangyou_item_path
+    },
+    'dear-worker': {
+        'name': 'dear-worker',
+        'base_url': 'https://item.rakuten.co.jp/dear-worker/',
+        'item_path': dear_worker_item_path
+    }
+}
 
 def read_skus_from_excel(excel_path):
     """Read SKUs from first column of Excel file"""
     try:
-        df = pd.read_excel(excel_path)
-        skus = df.iloc[:, 0].dropna().astype(str).tolist()
+        # Stream only column A in read-only mode; row 1 is the header
+        wb = openpyxl.load_workbook(excel_path, read_only=True, data_only=True)
+        ws = wb.worksheets[0]
+        skus = [str(value) for (value,) in ws.iter_rows(min_row=2, max_col=1, values_only=True) if value is not None]
+        wb.close()
         return [sku for sku in skus if sku.lower() != 'skuコード']
     except Exception as e:
         print(f"Error reading Excel file: {e}")
@@ -48,7 +122,7 @@ def get_price_from_soup(soup):
             if price_element:
                 price_text = price_element.text.strip()
                 # Remove currency symbols and commas
-                price_text = ''.join(filter(str.isdigit, price_text))
+                price_text = extract_digits(price_text)
                 if price_text:
                     return int(price_text)
         return None
@@ -56,8 +130,8 @@ def get_price_from_soup(soup):
         print(f"Error extracting price: {e}")
         return None
 
-def get_points_from_soup(soup):
-    """Extract points from soup with multiple selector attempts"""
+def get_points_from_soup(soup, price):
+    """Extract points from soup; percentage points are computed from the page's price"""
     try:
         # Try all possible points selectors in order
         points_selectors = [
@@ -76,14 +150,13 @@ def get_points_from_soup(soup):
                 # Remove non-digit characters and handle percentage
                 if '%' in points_text:
                     # Handle percentage points
-                    percentage = float(''.join(filter(lambda x: x.isdigit() or x == '.', points_text)))
+                    percentage = float(NON_NUMBER_RE.sub('', points_text))
                     # If we have price, calculate points
-                    price = get_price_from_soup(soup)
                     if price:
                         return int(price * (percentage / 100))
                 else:
                     # Direct point value
-                    points_text = ''.join(filter(str.isdigit, points_text))
+                    points_text = extract_digits(points_text)
                     if points_text:
                         return int(points_text)
         return None
@@ -95,8 +168,8 @@ def get_variant_info(session, base_url):
     """Get all variants information including colors and sizes"""
     variants = []
     try:
-        response = session.get(base_url, headers=get_headers())
-        soup = BeautifulSoup(response.text, 'html.parser')
+        response = session.get(base_url, headers=get_headers(), timeout=REQUEST_TIMEOUT)
+        soup = BeautifulSoup(response.text, HTML_PARSER)
         
         # Get color variants
         color_buttons = soup.select("div.grid-cols-2--1uI00 button.type-sku-button--BJoVv")
@@ -139,32 +212,31 @@ def get_variant_info(session, base_url):
                 variant_id += 1
 
                 # Get variant information
-                variant_response = session.get(variant_url, headers=get_headers())
-                variant_soup = BeautifulSoup(variant_response.text, 'html.parser')
+                variant_response = session.get(variant_url, headers=get_headers(), timeout=REQUEST_TIMEOUT)
+                variant_soup = BeautifulSoup(variant_response.text, HTML_PARSER)
 
                 # Get price and points using new helper functions
-                variants[-1]['価格'] = get_price_from_soup(variant_soup)
-                variants[-1]['ポイント'] = get_points_from_soup(variant_soup)
+                price = get_price_from_soup(variant_soup)
+                variants[-1]['価格'] = price
+                variants[-1]['ポイント'] = get_points_from_soup(variant_soup, price)
 
                 try:
                     # Get coupon
                     coupon_element = variant_soup.select_one("div.coupon")
                     if coupon_element:
                         coupon_text = coupon_element.text
-                        coupon_value = int(''.join(filter(str.isdigit, coupon_text)))
+                        coupon_value = int(extract_digits(coupon_text))
                         variants[-1]['クーポン'] = coupon_value
                 except:
                     pass
 
                 try:
-                    # Check inventory status
-                    out_of_stock = variant_soup.find(string='売り切れ')
-                    if out_of_stock:
+                    # Check inventory status; a sold-out label anywhere wins over in-stock
+                    stock_labels = variant_soup.find_all(string=['売り切れ', '在庫あり'])
+                    if '売り切れ' in stock_labels:
                         variants[-1]['在庫状況'] = '在庫なし'
-                    else:
-                        in_stock = variant_soup.find(string='在庫あり')
-                        if in_stock:
-                            variants[-1]['在庫状況'] = '在庫あり'
+                    elif stock_labels:
+                        variants[-1]['在庫状況'] = '在庫あり'
                 except:
                     pass
 
@@ -195,19 +267,20 @@ def get_kougushop_variant_info(session, base_url):
             })
 
             # Get variant information
-            variant_response = session.get(variant_url, headers=get_headers())
-            variant_soup = BeautifulSoup(variant_response.text, 'html.parser')
+            variant_response = session.get(variant_url, headers=get_headers(), timeout=REQUEST_TIMEOUT)
+            variant_soup = BeautifulSoup(variant_response.text, HTML_PARSER)
 
             # Get price and points using new helper functions
-            variants[-1]['価格'] = get_price_from_soup(variant_soup)
-            variants[-1]['ポイント'] = get_points_from_soup(variant_soup)
+            price = get_price_from_soup(variant_soup)
+            variants[-1]['価格'] = price
+            variants[-1]['ポイント'] = get_points_from_soup(variant_soup, price)
 
             try:
                 # Get coupon
                 coupon_element = variant_soup.select_one("div.coupon")
                 if coupon_element:
                     coupon_text = coupon_element.text
-                    coupon_value = int(''.join(filter(str.isdigit, coupon_text)))
+                    coupon_value = int(extract_digits(coupon_text))
                     variants[-1]['クーポン'] = coupon_value
                 else:
                     variants[-1]['クーポン'] = None
@@ -215,14 +288,12 @@ def get_kougushop_variant_info(session, base_url):
                 pass
 
             try:
-                # Check inventory status
-                out_of_stock = variant_soup.find(string='売り切れ')
-                if out_of_stock:
+                # Check inventory status; a sold-out label anywhere wins over in-stock
+                stock_labels = variant_soup.find_all(string=['売り切れ', '在庫あり'])
+                if '売り切れ' in stock_labels:
                     variants[-1]['在庫状況'] = '在庫なし'
-                else:
-                    in_stock = variant_soup.find(string='在庫あり')
-                    if in_stock:
-                        variants[-1]['在庫状況'] = '在庫あり'
+                elif stock_labels:
+                    variants[-1]['在庫状況'] = '在庫あり'
             except:
                 pass
 
@@ -237,7 +308,7 @@ def get_kougushop_variant_info(session, base_url):
 def scrape_product_info(session, url, is_waste_shop=False, is_kougushop=False, is_kouei_shop=False, is_dear_worker=False):
     """Scrape product information from a given URL"""
     try:
-        response = session.get(url, headers=get_headers())
+        response = session.get(url, headers=get_headers(), timeout=REQUEST_TIMEOUT)
         time.sleep(random.uniform(1, 2))  # Random delay
 
         # Initialize product info dictionary
@@ -284,6 +355,12 @@ def main():
 
     # Create a session for connection pooling
     session = requests.Session()
+    session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=RETRY_POLICY))
+    
+    # Each finished item is appended here (one JSON object per line) so an
+    # interrupted run keeps its results without rewriting the whole file per SKU
+    progress_path = 'results_beautifulsoup.jsonl'
+    progress_fp = open(progress_path, 'wb')
 
     try:
         # Process each SKU
@@ -313,33 +390,9 @@ def main():
             }
             
             # Add shop information
-            for shop_code, shop_info in {
-                'waste': {
-                    'name': 'e-life＆work shop',
-                    'base_url': 'https://item.rakuten.co.jp/waste/'
-                },
-                'kougushop': {
-                    'name': '工具ショップ',
-                    'base_url': 'https://item.rakuten.co.jp/kougushop/'
-                },
-                'kouei-sangyou': {
-                    'name': '晃栄産業',
-                    'base_url': 'https://item.rakuten.co.jp/kouei-sangyou/'
-                },
-                'dear-worker': {
-                    'name': 'dear-worker',
-                    'base_url': 'https://item.rakuten.co.jp/dear-worker/'
-                }
-            }.items():
+            for shop_code, shop_info in SHOPS.items():
                 # Generate shop-specific URL
-                if shop_code == 'waste':
-                    url = f"{shop_info['base_url']}cp209/?rafcid=wsc_i_is_1085274442429696242"
-                elif shop_code == 'kougushop':
-                    url = f"{shop_info['base_url']}{sku.split('-')[1]}-{sku.split('-')[2]}/?rafcid=wsc_i_is_1085274442429696242"
-                elif shop_code == 'kouei-sangyou':
-                    url = f"{shop_info['base_url']}fcp209/?rafcid=wsc_i_is_1085274442429696242"
-                else:  # dear-worker
-                    url = f"{shop_info['base_url']}cp209boa/?rafcid=wsc_i_is_1085274442429696242"
+                url = f"{shop_info['base_url']}{shop_info['item_path'](sku)}/?rafcid={RAFCID}"
 
                 item['shop_info'][shop_code] = {
                     'shop_name': shop_info['name'],
@@ -380,7 +433,6 @@ def main():
             print(f"  Progress: {idx}/{len(skus)} ({idx/len(skus)*100:.1f}%)")
             print(f"  Estimated time remaining: {remaining_time/60:.1f} minutes")
 
-            # Save results after each item (in case of interruption)
             results['metadata'].update({
                 'processed_skus': idx,
                 'current_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
@@ -388,8 +440,9 @@ def main():
                 'average_time_per_sku': round(avg_time, 2)
             })
             
-            with open('results_beautifulsoup.json', 'w', encoding='utf-8') as f:
-                json.dump(results, ensure_ascii=False, indent=2, fp=f)
+            # Append the item to the progress file (in case of interruption)
+            progress_fp.write(orjson.dumps(item) + b'\n')
+            progress_fp.flush()
 
         # Final metadata update
         results['metadata'].update({
@@ -399,14 +452,15 @@ def main():
         })
 
         # Final save
-        with open('results_beautifulsoup.json', 'w', encoding='utf-8') as f:
-            json.dump(results, ensure_ascii=False, indent=2, fp=f)
+        with open('results_beautifulsoup.json', 'wb') as f:
+            f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
 
         print("\nScraping completed successfully!")
         print(f"Total time: {time.time() - start_time:.2f} seconds")
         print(f"Average time per SKU: {(time.time() - start_time)/len(skus):.2f} seconds")
 
     finally:
+        progress_fp.close()
         session.close()
 
 if __name__ == "__main__":
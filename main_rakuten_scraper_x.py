@@ -1,29 +1,126 @@
-import pandas as pd
+import openpyxl
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from bs4 import BeautifulSoup
+import soupsieve
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
 from webdriver_manager.chrome import ChromeDriverManager
 import urllib.parse
-import json
+import orjson
 import time
 from datetime import datetime
 import threading
-from queue import Queue
-from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Empty
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import product
+import re
+
+# SKUs are scraped in parallel, each with its own browser, and every SKU
+# fetches its variant pages concurrently under one overall rate limit
+SKU_WORKERS = 4
+VARIANT_WORKERS = 4
+REQUESTS_PER_SECOND = 4
+
+class RateLimiter:
+    """Thread-safe limiter that spaces calls at least 1/rate seconds apart"""
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until the caller is allowed to send the next request"""
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+RATE_LIMITER = RateLimiter(REQUESTS_PER_SECOND)
+
+# Variant pages are server-rendered, so they are fetched over plain HTTP
+# instead of being loaded in the browser
+RETRY_POLICY = Retry(
+    total=3,
+    backoff_factor=1,
+    status_forcelist=[429, 500, 502, 503, 504],
+    respect_retry_after_header=True,
+    raise_on_status=False
+)
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=SKU_WORKERS * VARIANT_WORKERS, max_retries=RETRY_POLICY))
+SESSION.headers['User-Agent'] = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+# (connect, read) timeouts for variant pages
+REQUEST_TIMEOUT = (3.05, 15)
+
+# libxml2-backed parser for variant pages
+HTML_PARSER = 'lxml'
+
+# Variant page selectors, compiled once; price and points try the new layout first
+PRICE_SELECTORS = [
+    soupsieve.compile("div.value--1oSD_.layout-inline--2z490.size-x-large--DyMl5.style-bold500--1X0Xl.color-crimson--2uc0e.align-right--3POGa"),
+    soupsieve.compile("span.price--OX_YW")
+]
+POINTS_SELECTORS = [
+    soupsieve.compile("div.point-summary__total___3rYYD span"),
+    soupsieve.compile("span.price--point-badge_item")
+]
+COUPON_SELECTOR = soupsieve.compile("div.coupon")
+
+# Product page variant buttons (read through Selenium)
+COLOR_BUTTONS_SELECTOR = "div.grid-cols-2--1uI00 button.type-sku-button--BJoVv"
+SIZE_BUTTONS_SELECTOR = "div.grid-cols-5--3wKbc button.type-sku-button--BJoVv"
+
+# Longest wait, in seconds, for the variant buttons to appear on a product page
+BUTTONS_WAIT_SECONDS = 5
+
+# Everything that is not a digit, e.g. "円OFF" around coupon amounts
+NON_DIGIT_RE = re.compile(r'\D+')
+
+# Stock labels searched for anywhere in a variant page's text (one pass for both)
+STOCK_LABEL_RE = re.compile('売り切れ|在庫あり')
 
 def read_skus_from_excel(excel_path):
     """Read SKUs from first column of Excel file"""
     try:
-        df = pd.read_excel(excel_path)
-        skus = df.iloc[:, 0].dropna().astype(str).tolist()
+        # Stream only column A in read-only mode; row 1 is the header
+        wb = openpyxl.load_workbook(excel_path, read_only=True, data_only=True)
+        ws = wb.worksheets[0]
+        skus = [str(value) for (value,) in ws.iter_rows(min_row=2, max_col=1, values_only=True) if value is not None]
+        wb.close()
         return [sku for sku in skus if sku.lower() != 'skuコード']
     except Exception as e:
         print(f"Error reading Excel file: {e}")
         return []
 
+# Resources the scraper never needs, blocked in the browser via DevTools
+BLOCKED_URL_PATTERNS = [
+    '*.woff', '*.woff2', '*.ttf', '*.otf',
+    '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*',
+    '*criteo*', '*facebook.net*'
+]
+
+# ChromeDriver binary path, resolved once per process by get_chromedriver_path
+chromedriver_path = None
+chromedriver_lock = threading.Lock()
+
+def get_chromedriver_path():
+    """Install (or find the cached) ChromeDriver once and reuse its path"""
+    global chromedriver_path
+    with chromedriver_lock:
+        if chromedriver_path is None:
+            chromedriver_path = ChromeDriverManager().install()
+        return chromedriver_path
+
 def setup_webdriver():
     """Setup and return configured Chrome WebDriver"""
     chrome_options = Options()
@@ -36,16 +133,131 @@ def setup_webdriver():
     }
     chrome_options.add_experimental_option("prefs", prefs)
 
-    service = Service(ChromeDriverManager().install())
-    return webdriver.Chrome(service=service, options=chrome_options)
+    # Return once the DOM is parsed; variant buttons are waited for explicitly
+    chrome_options.page_load_strategy = 'eager'
+
+    service = Service(get_chromedriver_path())
+    driver = webdriver.Chrome(service=service, options=chrome_options)
+
+    # Skip downloading web fonts, trackers and ads on every product page
+    driver.execute_cdp_cmd('Network.enable', {})
+    driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_URL_PATTERNS})
+    return driver
+
+def select_first(soup, selectors):
+    """Return the first element matched by any of the compiled selectors, in order"""
+    for selector in selectors:
+        element = selector.select_one(soup)
+        if element:
+            return element
+    return None
+
+def scrape_variant(variant):
+    """Fetch a variant page and fill in its price, points, coupon and stock status"""
+    RATE_LIMITER.acquire()
+    response = SESSION.get(variant['url'], timeout=REQUEST_TIMEOUT)
+    soup = BeautifulSoup(response.text, HTML_PARSER)
+
+    try:
+        # Get price - try both new and old selectors
+        price_element = select_first(soup, PRICE_SELECTORS)
+        
+        if price_element:
+            variant['価格'] = int(price_element.get_text(strip=True).replace('円', '').replace(',', ''))
+    except:
+        pass
+
+    try:
+        # Get points
+        points_element = select_first(soup, POINTS_SELECTORS)
+        
+        if points_element:
+            points_text = points_element.get_text(strip=True).replace('ポイント', '').replace(',', '')
+            variant['ポイント'] = int(points_text) if points_text.isdigit() else None
+    except:
+        pass
+
+    try:
+        # Get coupon
+        coupon_element = COUPON_SELECTOR.select_one(soup)
+        coupon_text = coupon_element.get_text(strip=True) if coupon_element else ''
+        if coupon_text:
+            coupon_value = int(NON_DIGIT_RE.sub('', coupon_text))
+            variant['クーポン'] = coupon_value
+    except:
+        pass
+
+    try:
+        # Check inventory status; a sold-out label anywhere wins over in-stock
+        stock_labels = soup.find_all(string=STOCK_LABEL_RE)
+        if any('売り切れ' in label for label in stock_labels):
+            variant['在庫状況'] = '在庫なし'
+        elif stock_labels:
+            variant['在庫状況'] = '在庫あり'
+    except:
+        pass
+
+def scrape_variants(variants):
+    """Scrape all variant pages concurrently, paced by the shared rate limiter"""
+    with ThreadPoolExecutor(max_workers=VARIANT_WORKERS) as executor:
+        list(executor.map(scrape_variant, variants))
+
+class DriverPool:
+    """Chrome drivers reused across SKUs instead of launching a browser per SKU"""
+    def __init__(self):
+        self.idle = Queue()
+        self.drivers = []
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Return an idle driver, starting a new one only when none is free"""
+        try:
+            return self.idle.get_nowait()
+        except Empty:
+            driver = setup_webdriver()
+            with self.lock:
+                self.drivers.append(driver)
+            return driver
+
+    def release(self, driver):
+        """Reset the driver's cookies and return it to the pool"""
+        try:
+            driver.delete_all_cookies()
+        except Exception:
+            # The browser died; drop it so the next SKU starts a fresh one
+            with self.lock:
+                self.drivers.remove(driver)
+            try:
+                driver.quit()
+            except Exception:
+                pass
+            return
+        self.idle.put(driver)
+
+    def close(self):
+        """Quit every driver started by the pool"""
+        with self.lock:
+            drivers, self.drivers = self.drivers, []
+        for driver in drivers:
+            driver.quit()
 
 def get_variant_info(driver, base_url):
-    """Get all variants information including colors and sizes"""
-    variants = []
+    """Get all variants information including colors and sizes (None if the buttons couldn't be read)"""
+    variants = None
     try:
+        # Wait until the size buttons are rendered rather than sleeping a fixed time
+        try:
+            WebDriverWait(driver, BUTTONS_WAIT_SECONDS).until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, SIZE_BUTTONS_SELECTOR))
+            )
+        except TimeoutException:
+            # The page loaded but has no size buttons, so it has no variants
+            print(f"No variant buttons found on {base_url}")
+            return []
+        
         # Get color variants
-        color_buttons = driver.find_elements(By.CSS_SELECTOR, "div.grid-cols-2--1uI00 button.type-sku-button--BJoVv")
-        size_buttons = driver.find_elements(By.CSS_SELECTOR, "div.grid-cols-5--3wKbc button.type-sku-button--BJoVv")
+        color_buttons = driver.find_elements(By.CSS_SELECTOR, COLOR_BUTTONS_SELECTOR)
+        size_buttons = driver.find_elements(By.CSS_SELECTOR, SIZE_BUTTONS_SELECTOR)
         
         # Extract color and size information
         colors = []
@@ -66,147 +278,50 @@ def get_variant_info(driver, base_url):
                 'selected': is_selected
             })
 
-        # Generate all possible combinations
-        variant_id = 1
-        for color in colors:
-            for size in sizes:
-                variant_url = f"{base_url}&variantId=r-sku{variant_id:08d}"
-                variants.append({
-                    'color': color['name'],
-                    'size': size['name'],
-                    'variant_id': f"r-sku{variant_id:08d}",
-                    'url': variant_url,
-                    '価格': None,
-                    'ポイント': None,
-                    'クーポン': None,
-                    '在庫状況': None
-                })
-                variant_id += 1
-
-                # Visit variant URL and get its information
-                driver.get(variant_url)
-                time.sleep(1)  # Wait for page to load
-
-                try:
-                    # Get price - try both new and old selectors
-                    price_element = None
-                    try:
-                        price_element = driver.find_element(By.CSS_SELECTOR, "div.value--1oSD_.layout-inline--2z490.size-x-large--DyMl5.style-bold500--1X0Xl.color-crimson--2uc0e.align-right--3POGa")
-                    except:
-                        price_element = driver.find_element(By.CSS_SELECTOR, "span.price--OX_YW")
-                    
-                    if price_element:
-                        variants[-1]['価格'] = int(price_element.text.replace('円', '').replace(',', ''))
-                except:
-                    pass
-
-                try:
-                    # Get points
-                    points_element = driver.find_element(By.CSS_SELECTOR, "div.point-summary__total___3rYYD span")
-                    if not points_element:
-                        points_element = driver.find_element(By.CSS_SELECTOR, "span.price--point-badge_item")
-                    
-                    if points_element:
-                        points_text = points_element.text.replace('ポイント', '').replace(',', '')
-                        variants[-1]['ポイント'] = int(points_text) if points_text.isdigit() else None
-                except:
-                    pass
-
-                try:
-                    # Get coupon
-                    coupon_element = driver.find_element(By.CSS_SELECTOR, "div.coupon")
-                    coupon_text = coupon_element.text
-                    if coupon_text:
-                        coupon_value = int(''.join(filter(str.isdigit, coupon_text)))
-                        variants[-1]['クーポン'] = coupon_value
-                except:
-                    pass
-
-                try:
-                    # Check inventory status
-                    out_of_stock = driver.find_elements(By.XPATH, "//*[contains(text(), '売り切れ')]")
-                    if out_of_stock:
-                        variants[-1]['在庫状況'] = '在庫なし'
-                    else:
-                        in_stock = driver.find_elements(By.XPATH, "//*[contains(text(), '在庫あり')]")
-                        if in_stock:
-                            variants[-1]['在庫状況'] = '在庫あり'
-                except:
-                    pass
+        # Generate all possible combinations, numbered color-major from r-sku00000001
+        variants = [
+            {
+                'color': color['name'],
+                'size': size['name'],
+                'variant_id': f"r-sku{variant_id:08d}",
+                'url': f"{base_url}&variantId=r-sku{variant_id:08d}",
+                '価格': None,
+                'ポイント': None,
+                'クーポン': None,
+                '在庫状況': None
+            }
+            for variant_id, (color, size) in enumerate(product(colors, sizes), 1)
+        ]
+
+        # Fetch every variant page
+        scrape_variants(variants)
 
     except Exception as e:
         print(f"Error getting variants: {e}")
     
     return variants
 
-def get_kougushop_variant_info(driver, base_url):
+def get_kougushop_variant_info(base_url):
     """Get variants information for kougushop"""
     variants = []
     try:
         # For kougushop, variants are numbered from 8021 to 8034 for sizes 22.5 to 30
         sizes = ['22.5', '23', '23.5', '24', '24.5', '25', '25.5', '26', '26.5', '27', '27.5', '28', '29', '30']
-        for idx, size in enumerate(sizes, 8021):
-            variant_url = f"{base_url}&variantId={idx}"
-            variants.append({
+        variants = [
+            {
                 'size': size,
                 'variant_id': str(idx),
-                'url': variant_url,
+                'url': f"{base_url}&variantId={idx}",
                 '価格': None,
                 'ポイント': None,
                 'クーポン': None,
                 '在庫状況': None
-            })
+            }
+            for idx, size in enumerate(sizes, 8021)
+        ]
 
-            # Visit variant URL and get its information
-            driver.get(variant_url)
-            time.sleep(1)  # Wait for page to load
-
-            try:
-                # Get price - try both new and old selectors
-                price_element = None
-                try:
-                    price_element = driver.find_element(By.CSS_SELECTOR, "div.value--1oSD_.layout-inline--2z490.size-x-large--DyMl5.style-bold500--1X0Xl.color-crimson--2uc0e.align-right--3POGa")
-                except:
-                    price_element = driver.find_element(By.CSS_SELECTOR, "span.price--OX_YW")
-                
-                if price_element:
-                    variants[-1]['価格'] = int(price_element.text.replace('円', '').replace(',', ''))
-            except:
-                pass
-
-            try:
-                # Get points
-                points_element = driver.find_element(By.CSS_SELECTOR, "div.point-summary__total___3rYYD span")
-                if not points_element:
-                    points_element = driver.find_element(By.CSS_SELECTOR, "span.price--point-badge_item")
-                
-                if points_element:
-                    points_text = points_element.text.replace('ポイント', '').replace(',', '')
-                    variants[-1]['ポイント'] = int(points_text) if points_text.isdigit() else None
-            except:
-                pass
-
-            try:
-                # Get coupon
-                coupon_element = driver.find_element(By.CSS_SELECTOR, "div.coupon")
-                coupon_text = coupon_element.text
-                if coupon_text:
-                    coupon_value = int(''.join(filter(str.isdigit, coupon_text)))
-                    variants[-1]['クーポン'] = coupon_value
-            except:
-                pass
-
-            try:
-                # Check inventory status
-                out_of_stock = driver.find_elements(By.XPATH, "//*[contains(text(), '売り切れ')]")
-                if out_of_stock:
-                    variants[-1]['在庫状況'] = '在庫なし'
-                else:
-                    in_stock = driver.find_elements(By.XPATH, "//*[contains(text(), '在庫あり')]")
-                    if in_stock:
-                        variants[-1]['在庫状況'] = '在庫あり'
-            except:
-                pass
+        # Fetch every variant page
+        scrape_variants(variants)
 
     except Exception as e:
         print(f"Error getting kougushop variants: {e}")
@@ -216,8 +331,9 @@ def get_kougushop_variant_info(driver, base_url):
 def scrape_product_info(driver, url, is_waste_shop=False, is_kougushop=False, is_kouei_shop=False, is_dear_worker=False):
     """Scrape product information from a given URL"""
     try:
-        driver.get(url)
-        time.sleep(2)  # Wait for page to load
+        # Kougushop variants come from a fixed size table, so its page is never rendered
+        if not is_kougushop:
+            driver.get(url)
 
         # Initialize product info dictionary
         product_info = {
@@ -231,7 +347,7 @@ def scrape_product_info(driver, url, is_waste_shop=False, is_kougushop=False, is
             if is_waste_shop or is_kouei_shop or is_dear_worker:
                 product_info['variants'] = get_variant_info(driver, base_url)
             elif is_kougushop:
-                product_info['variants'] = get_kougushop_variant_info(driver, base_url)
+                product_info['variants'] = get_kougushop_variant_info(base_url)
 
         return product_info
 
@@ -239,11 +355,47 @@ def scrape_product_info(driver, url, is_waste_shop=False, is_kougushop=False, is
         print(f"Error scraping URL {url}: {e}")
         return None
 
-def process_sku(sku, idx, total_skus, result_queue, shops):
-    """Process a single SKU in a separate thread"""
+# Product pages already scraped in this run, keyed by URL. Most shops use the
+# same item page for every SKU, so each page and its variants are fetched once.
+product_info_cache = {}
+product_info_locks = {}
+product_info_locks_guard = threading.Lock()
+
+def is_complete_product_info(product_info):
+    """True if every variant page was scraped, so the result is safe to reuse"""
+    if product_info is None or product_info['variants'] is None:
+        # Failed page load, or variant buttons that couldn't be read
+        return False
+    # A variant whose page failed to load keeps all its fields at None
+    return all(
+        variant['価格'] is not None or variant['在庫状況'] is not None
+        for variant in product_info['variants']
+    )
+
+def copy_product_info(product_info):
+    """Give each SKU its own product info and variant dicts"""
+    return {**product_info, 'variants': [dict(variant) for variant in product_info['variants']]}
+
+def get_product_info(driver, url, is_waste_shop=False, is_kougushop=False, is_kouei_shop=False, is_dear_worker=False):
+    """Scrape a product page once per run and reuse the result for every SKU sharing its URL"""
+    with product_info_locks_guard:
+        url_lock = product_info_locks.setdefault(url, threading.Lock())
+    
+    # Other SKUs needing the same URL wait here instead of scraping it again
+    with url_lock:
+        if url in product_info_cache:
+            return copy_product_info(product_info_cache[url])
+        product_info = scrape_product_info(driver, url, is_waste_shop, is_kougushop, is_kouei_shop, is_dear_worker)
+        # Don't cache failed or partial scrapes so the next SKU retries the page
+        if is_complete_product_info(product_info):
+            product_info_cache[url] = copy_product_info(product_info)
+        return product_info
+
+def process_sku(sku, idx, total_skus, shops, driver_pool):
+    """Process a single SKU in a separate thread and return its item (None on failure)"""
     driver = None
     try:
-        driver = setup_webdriver()
+        driver = driver_pool.acquire()
         sku_start_time = time.time()
         
         # Initialize item structure
@@ -297,7 +449,7 @@ def process_sku(sku, idx, total_skus, result_queue, shops):
                 is_dear_worker = shop_code == 'dear-worker'
                 
                 # Scrape product info
-                product_info = scrape_product_info(driver, url, is_waste_shop, is_kougushop, is_kouei_shop, is_dear_worker)
+                product_info = get_product_info(driver, url, is_waste_shop, is_kougushop, is_kouei_shop, is_dear_worker)
                 
                 if product_info:
                     if (is_waste_shop or is_kouei_shop or is_dear_worker) and product_info['variants']:
@@ -314,15 +466,14 @@ def process_sku(sku, idx, total_skus, result_queue, shops):
         elapsed_time = time.time() - sku_start_time
         print(f"  Time for SKU {sku}: {elapsed_time:.2f}s")
         
-        # Put result in queue
-        result_queue.put((idx, item))
+        return item
 
     except Exception as e:
         print(f"Error processing SKU {sku}: {e}")
-        result_queue.put((idx, None))
+        return None
     finally:
         if driver:
-            driver.quit()
+            driver_pool.release(driver)
 
 def main():
     start_time = time.time()
@@ -366,27 +517,32 @@ def main():
         }
     }
 
+    # One browser per worker, started on demand and reused for every SKU
+    driver_pool = DriverPool()
+    
+    # Each finished item is appended here (one JSON object per line) so an
+    # interrupted run keeps its results without rewriting the whole file per SKU
+    progress_path = 'results.jsonl'
+    progress_fp = open(progress_path, 'wb')
+
     try:
-        # Create a queue for results
-        result_queue = Queue()
-        
         # Process SKUs in batches of 4 using ThreadPoolExecutor
-        with ThreadPoolExecutor(max_workers=4) as executor:
+        with ThreadPoolExecutor(max_workers=SKU_WORKERS) as executor:
             # Submit all tasks
-            futures = []
-            for idx, sku in enumerate(skus, 1):
-                future = executor.submit(process_sku, sku, idx, len(skus), result_queue, shops)
-                futures.append(future)
+            futures = [
+                executor.submit(process_sku, sku, idx, len(skus), shops, driver_pool)
+                for idx, sku in enumerate(skus, 1)
+            ]
 
             # Process results as they complete
-            completed_count = 0
-            while completed_count < len(skus):
-                # Get result from queue
-                idx, item = result_queue.get()
-                completed_count += 1
+            for completed_count, future in enumerate(as_completed(futures), 1):
+                item = future.result()
                 
                 if item:
                     results['items'].append(item)
+                    # Append the item to the progress file (in case of interruption)
+                    progress_fp.write(orjson.dumps(item) + b'\n')
+                    progress_fp.flush()
                 
                 # Calculate progress
                 total_elapsed = time.time() - start_time
@@ -396,16 +552,12 @@ def main():
                 print(f"Progress: {completed_count}/{len(skus)} ({completed_count/len(skus)*100:.1f}%)")
                 print(f"Estimated time remaining: {remaining_time/60:.1f} minutes")
 
-                # Save intermediate results
                 results['metadata'].update({
                     'processed_skus': completed_count,
                     'current_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
                     'elapsed_time_seconds': round(total_elapsed, 2),
                     'average_time_per_sku': round(avg_time, 2)
                 })
-                
-                with open('results.json', 'w', encoding='utf-8') as f:
-                    json.dump(results, ensure_ascii=False, indent=2, fp=f)
 
         # Final metadata update
         results['metadata'].update({
@@ -415,8 +567,8 @@ def main():
         })
 
         # Final save
-        with open('results.json', 'w', encoding='utf-8') as f:
-            json.dump(results, ensure_ascii=False, indent=2, fp=f)
+        with open('results.json', 'wb') as f:
+            f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
 
         print("\nScraping completed successfully!")
         print(f"Total time: {time.time() - start_time:.2f} seconds")
@@ -424,6 +576,9 @@ def main():
 
     except Exception as e:
         print(f"Error in main process: {e}")
+    finally:
+        progress_fp.close()
+        driver_pool.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
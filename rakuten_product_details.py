@@ -1,79 +1,128 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 from urllib.parse import urlparse
 import os
-import pandas as pd
+import openpyxl
 import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
 
 # Constants
 API_ENDPOINT = 'https://app.rakuten.co.jp/services/api/IchibaItem/Search/20220601'
 APP_ID = '1085274442429696242'
 AFFILIATE_ID = '494cbb7b.da2d8105.494cbb7c.3832fe1e'
 
+# Search parameters shared by every request; only the keyword changes per call
+BASE_PARAMS = {
+    'applicationId': APP_ID,
+    'affiliateId': AFFILIATE_ID,
+    'hits': 1,
+    'format': 'json'
+}
+
+# Shared session so every API call reuses the same keep-alive connection.
+# Rate limits and server errors are retried with exponential backoff,
+# honouring the Retry-After header when the API sends one.
+RETRY_POLICY = Retry(
+    total=5,
+    backoff_factor=2,
+    status_forcelist=[429, 500, 502, 503, 504],
+    respect_retry_after_header=True
+)
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=10, max_retries=RETRY_POLICY))
+
+# Concurrency settings - Rakuten allows roughly 1 request/second per applicationId
+MAX_WORKERS = 4
+REQUESTS_PER_SECOND = 1
+
+class RateLimiter:
+    """Thread-safe limiter that spaces calls at least 1/rate seconds apart"""
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_time = time.monotonic()
+        self.lock = Lock()
+
+    def acquire(self):
+        """Block until the caller is allowed to send the next request"""
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+RATE_LIMITER = RateLimiter(REQUESTS_PER_SECOND)
+
 def read_skus_from_excel(excel_path='araki.xlsx'):
-    """Read SKUs from Excel file"""
-    engines = ['openpyxl', 'xlrd', 'odf']
-    for engine in engines:
-        try:
-            print(f"Trying with {engine} engine...")
-            df = pd.read_excel(excel_path, engine=engine)
-            # Get SKUs from column B (index 1)
-            skus = df.iloc[:, 1].dropna().astype(str).tolist()
-            valid_skus = [(idx + 2, sku) for idx, sku in enumerate(skus) if sku.strip()]
-            print(f"Found {len(valid_skus)} SKUs in Excel")
-            return valid_skus, df
-        except Exception as e:
-            print(f"Error with {engine} engine: {e}")
-            continue
-    return [], None
+    """Read SKUs from column B of the Excel file as (row number, sku) pairs"""
+    try:
+        wb = openpyxl.load_workbook(excel_path, read_only=True, data_only=True)
+        ws = wb.active
+        # Row 1 is the header; only columns A-B are read
+        valid_skus = [
+            (row_idx, str(sku).strip())
+            for row_idx, (_, sku) in enumerate(ws.iter_rows(min_row=2, max_col=2, values_only=True), start=2)
+            if sku is not None and str(sku).strip()
+        ]
+        wb.close()
+        print(f"Found {len(valid_skus)} SKUs in Excel")
+        return valid_skus
+    except Exception as e:
+        print(f"Error reading Excel file: {e}")
+        return []
 
 def fetch_item_details(item_code):
     """Fetch item details using Rakuten Ichiba Item Search API"""
-    params = {
-        'applicationId': APP_ID,
-        'affiliateId': AFFILIATE_ID,
-        'keyword': item_code,
-        'hits': 1,
-        'format': 'json'
-    }
+    params = {**BASE_PARAMS, 'keyword': item_code}
     
     try:
         print(f"\nFetching data for SKU: {item_code}")
-        response = requests.get(API_ENDPOINT, params=params)
+        RATE_LIMITER.acquire()
+        response = SESSION.get(API_ENDPOINT, params=params, timeout=15)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
         print(f"Error fetching data: {e}")
-        if hasattr(e.response, 'text'):
-            print(f"Response text: {e.response.text}")
+        response_text = getattr(e.response, 'text', '')
+        if response_text:
+            print(f"Response text: {response_text}")
         return None
 
-def update_excel(df, updates, excel_path='araki.xlsx'):
+def update_excel(updates, excel_path='araki.xlsx'):
     """Update Excel file with new data"""
     try:
-        # Apply updates to dataframe
+        wb = openpyxl.load_workbook(excel_path)
+        ws = wb.active
         for row_idx, item_name, price in updates:
-            df.iloc[row_idx-2, 2] = item_name  # Column C (index 2)
-            df.iloc[row_idx-2, 9] = price      # Column J (index 9)
+            ws.cell(row=row_idx, column=3, value=item_name)  # Column C
+            ws.cell(row=row_idx, column=10, value=price)     # Column J
         
-        # Save updated dataframe to Excel
-        df.to_excel(excel_path, index=False)
+        wb.save(excel_path)
         print(f"\nSuccessfully updated Excel file: {excel_path}")
     except Exception as e:
         print(f"Error updating Excel file: {e}")
 
 def main():
     # Read SKUs from Excel
-    skus, df = read_skus_from_excel()
-    if not skus or df is None:
+    skus = read_skus_from_excel()
+    if not skus:
         print("No SKUs found in Excel file")
         return
     
     updates = []
+    # Rows often repeat the same SKU, so each distinct SKU is fetched only once
+    unique_skus = list(dict.fromkeys(sku for _, sku in skus))
+
+    # Fetch SKUs concurrently; the shared rate limiter keeps us within API limits
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        results = dict(zip(unique_skus, executor.map(fetch_item_details, unique_skus)))
+
     # Process each SKU
     for row, sku in skus:
-        # Fetch item data
-        data = fetch_item_details(sku)
+        data = results[sku]
         if not data or 'Items' not in data or not data['Items']:
             print(f"No data found for SKU: {sku}")
             continue
@@ -87,13 +136,10 @@ def main():
             item.get('itemPrice', 'N/A')
         ))
         print(f"Got data for row {row}: {item.get('itemName', 'N/A')}, Price: {item.get('itemPrice', 'N/A')}")
-        
-        # Add delay to avoid API rate limits
-        time.sleep(1)
     
     # Update Excel file with all changes at once
     if updates:
-        update_excel(df, updates)
+        update_excel(updates)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file